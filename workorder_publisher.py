@@ -10,16 +10,21 @@ Author: Demo Application
 Version: 1.1.0
 """
 
+import base64
 import json
+import queue
 import random
-import string
+import socket
+import threading
 import time
 import uuid
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from typing import Any
+from zoneinfo import ZoneInfo
 
+import orjson
 import paho.mqtt.client as mqtt
-import pytz
 
 
 # =============================================================================
@@ -30,6 +35,55 @@ WORKORDER_NAMESPACE = "https://www.github.com/eukodyne/cesmii/smprofiles/WorkOrd
 FEEDINGREDIENT_NAMESPACE = "https://www.github.com/eukodyne/cesmii/smprofiles/FeedIngredientV1"
 
 
+# =============================================================================
+# Payload Templates
+# =============================================================================
+
+# Key order matches the published payload; None entries are filled per order.
+_WORKORDER_TEMPLATE: dict[str, Any] = {
+    "$namespace": WORKORDER_NAMESPACE,
+    "$comment": "Work order conforming to WorkOrderV1 SM Profile",
+    "WorkOrderID": None,
+    "WorkOrderNumber": None,
+    "TimeZone": None,
+    "StartTimeLocal": None,
+    "StartTimeUTC": None,
+    "EndTimeLocal": None,
+    "EndTimeUTC": None,
+    "ProductID": None,
+    "ProductNumber": None,
+    "ProductName": None,
+    "LotNumber": None,
+    "UnitOfMeasure": "CS",
+    "Quantity": None,
+    "WeightUnitOfMeasure": "lb",
+    "Weight": None,
+    "FeedIngredients": None
+}
+
+_FEEDINGREDIENT_TEMPLATE: dict[str, Any] = {
+    "$namespace": FEEDINGREDIENT_NAMESPACE,
+    "ProductID": None,
+    "ProductNumber": None,
+    "ProductName": None,
+    "LotNumber": None,
+    "UnitOfMeasure": "CS",
+    "Quantity": None,
+    "WeightUnitOfMeasure": "lb",
+    "Weight": None
+}
+
+
+def _serialize_work_order(work_order: dict[str, Any]) -> bytes:
+    """Serialize a work order as compact JSON."""
+    return orjson.dumps(work_order)
+
+
+def _serialize_work_orders(work_orders: list[dict[str, Any]]) -> bytes:
+    """Serialize a batch of work orders as a single {"WorkOrders": [...]} payload."""
+    return orjson.dumps({"WorkOrders": work_orders})
+
+
 # =============================================================================
 # Demo Products Definition
 # =============================================================================
@@ -43,6 +97,12 @@ class FeedIngredient:
         self.product_name = product_name
         self.mix_proportion = mix_proportion  # As decimal (0.10 = 10%)
 
+        # Static FeedIngredientV1 fields, copied for each work order
+        self.template = _FEEDINGREDIENT_TEMPLATE.copy()
+        self.template["ProductID"] = product_id
+        self.template["ProductNumber"] = product_number
+        self.template["ProductName"] = product_name
+
 
 class DemoProduct:
     """Represents a demo product with its feed ingredients."""
@@ -133,23 +193,38 @@ def create_demo_products() -> list[DemoProduct]:
 # Work Order Generation
 # =============================================================================
 
+def _fast_uuid_str() -> str:
+    """
+    Return a random (version 4) UUID string without building a uuid.UUID object.
+
+    Draws from the Mersenne Twister rather than os.urandom; WorkOrderID only
+    needs to be unique, not unpredictable.
+    """
+    n = random.getrandbits(128)
+    n = (n & ~(0xF000 << 64)) | (0x4000 << 64)  # Version 4
+    n = (n & ~(0xC000 << 48)) | (0x8000 << 48)  # RFC 4122 variant
+    h = f"{n:032x}"
+    return f"{h[0:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+
+
 class WorkOrderGenerator:
     """Generates work orders conforming to the WorkOrderV1 SM Profile."""
 
     def __init__(self, demo_products: list[DemoProduct]):
         self.demo_products = demo_products
         self.work_order_counter = 100000  # Starting work order number
-        self.central_tz = pytz.timezone('America/Chicago')  # US Central Time
+        self.central_tz = ZoneInfo('America/Chicago')  # US Central Time
+        self._tz_cache: tuple[float, dict[str, Any]] = (0.0, {})  # (expiry timestamp, TimeZone data)
 
     def _generate_random_lot(self, length: int = 6) -> str:
-        """Generate a random alphanumeric lot number in all caps."""
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+        """Generate a random alphanumeric lot number in all caps (base32 alphabet A-Z, 2-7)."""
+        # Each base32 character carries 5 bits, so draw just enough random bytes
+        return base64.b32encode(random.randbytes((length * 5 + 7) // 8))[:length].decode('ascii')
 
     def _get_quantity_divisible_by_6(self, min_val: int = 12, max_val: int = 120) -> int:
         """Generate a random quantity between min and max that is divisible by 6."""
-        # Get all multiples of 6 in the range
-        multiples = [x for x in range(min_val, max_val + 1) if x % 6 == 0]
-        return random.choice(multiples)
+        # Step through the multiples of 6 directly, starting at the first one >= min_val
+        return random.randrange(-(-min_val // 6) * 6, max_val + 1, 6)
 
     def _get_timezone_data(self) -> dict[str, Any]:
         """
@@ -158,7 +233,15 @@ class WorkOrderGenerator:
         TimeZoneDataType (OPC UA) structure:
         - offset: Int16 - Time difference from UTC in minutes
         - daylightSavingInOffset: Boolean - If TRUE, DST is in effect
+
+        The result is cached until the next hour boundary; DST transitions
+        always land on an hour boundary, so the cached value stays accurate.
         """
+        now_ts = time.time()
+        expiry, cached = self._tz_cache
+        if now_ts < expiry:
+            return cached
+
         now = datetime.now(self.central_tz)
 
         # Get UTC offset in minutes
@@ -169,10 +252,13 @@ class WorkOrderGenerator:
         dst = now.dst()
         dst_in_effect = dst is not None and dst.total_seconds() > 0
 
-        return {
+        timezone_data = {
             "offset": offset_minutes,
             "daylightSavingInOffset": dst_in_effect
         }
+        self._tz_cache = ((now_ts // 3600 + 1) * 3600, timezone_data)
+
+        return timezone_data
 
     def generate_work_order(self) -> dict[str, Any]:
         """
@@ -185,10 +271,10 @@ class WorkOrderGenerator:
         tmp_product = random.choice(self.demo_products)
 
         # Calculate times
-        now_utc = datetime.now(pytz.UTC)
+        now_utc = datetime.now(timezone.utc)
         now_local = now_utc.astimezone(self.central_tz)
         end_utc = now_utc + timedelta(hours=8)
-        end_local = now_local + timedelta(hours=8)
+        end_local = end_utc.astimezone(self.central_tz)
 
         # Generate quantity and weight
         tmp_quantity = float(self._get_quantity_divisible_by_6())
@@ -203,39 +289,28 @@ class WorkOrderGenerator:
             ingredient_quantity = tmp_quantity * ingredient.mix_proportion
             ingredient_weight = tmp_weight * ingredient.mix_proportion
 
-            feed_ingredients.append({
-                "$namespace": FEEDINGREDIENT_NAMESPACE,
-                "ProductID": ingredient.product_id,
-                "ProductNumber": ingredient.product_number,
-                "ProductName": ingredient.product_name,
-                "LotNumber": self._generate_random_lot(),
-                "UnitOfMeasure": "CS",
-                "Quantity": ingredient_quantity,
-                "WeightUnitOfMeasure": "lb",
-                "Weight": ingredient_weight
-            })
+            feed_ingredient = ingredient.template.copy()
+            feed_ingredient["LotNumber"] = self._generate_random_lot()
+            feed_ingredient["Quantity"] = ingredient_quantity
+            feed_ingredient["Weight"] = ingredient_weight
+            feed_ingredients.append(feed_ingredient)
 
         # Build work order with CESMII $namespace format
-        work_order = {
-            "$namespace": WORKORDER_NAMESPACE,
-            "$comment": "Work order conforming to WorkOrderV1 SM Profile",
-            "WorkOrderID": str(uuid.uuid4()),
-            "WorkOrderNumber": self.work_order_counter,
-            "TimeZone": self._get_timezone_data(),
-            "StartTimeLocal": now_local.isoformat(),
-            "StartTimeUTC": now_utc.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-            "EndTimeLocal": end_local.isoformat(),
-            "EndTimeUTC": end_utc.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-            "ProductID": tmp_product.product_id,
-            "ProductNumber": tmp_product.product_number,
-            "ProductName": tmp_product.product_name,
-            "LotNumber": lot_number,
-            "UnitOfMeasure": "CS",
-            "Quantity": tmp_quantity,
-            "WeightUnitOfMeasure": "lb",
-            "Weight": tmp_weight,
-            "FeedIngredients": feed_ingredients
-        }
+        work_order = _WORKORDER_TEMPLATE.copy()
+        work_order["WorkOrderID"] = _fast_uuid_str()
+        work_order["WorkOrderNumber"] = self.work_order_counter
+        work_order["TimeZone"] = self._get_timezone_data()
+        work_order["StartTimeLocal"] = now_local.isoformat()
+        work_order["StartTimeUTC"] = now_utc.replace(tzinfo=None).isoformat(timespec='microseconds') + "Z"
+        work_order["EndTimeLocal"] = end_local.isoformat()
+        work_order["EndTimeUTC"] = end_utc.replace(tzinfo=None).isoformat(timespec='microseconds') + "Z"
+        work_order["ProductID"] = tmp_product.product_id
+        work_order["ProductNumber"] = tmp_product.product_number
+        work_order["ProductName"] = tmp_product.product_name
+        work_order["LotNumber"] = lot_number
+        work_order["Quantity"] = tmp_quantity
+        work_order["Weight"] = tmp_weight
+        work_order["FeedIngredients"] = feed_ingredients
 
         # Increment work order counter for next order
         self.work_order_counter += 1
@@ -247,6 +322,9 @@ class WorkOrderGenerator:
 # MQTT Publisher
 # =============================================================================
 
+INFLIGHT_TIMEOUT_SECONDS = 60  # Drop messages not yet sent from accounting after this long
+
+
 class MQTTWorkOrderPublisher:
     """Publishes work orders to MQTT broker as retained messages."""
 
@@ -254,6 +332,11 @@ class MQTTWorkOrderPublisher:
         self.config = config
         self.client: mqtt.Client | None = None
         self.connected = False
+        # Message ID -> (publish time, description) of work order(s) not yet sent, oldest first
+        self.inflight: OrderedDict[int, tuple[float, str]] = OrderedDict()
+        self._inflight_lock = threading.Lock()
+        # Message IDs whose on_publish fired before _publish recorded them
+        self._early_acks: set[int] = set()
 
     def _on_connect(self, client: mqtt.Client, userdata: Any, flags: dict, reason_code: int, properties: Any = None) -> None:
         """Callback when connected to MQTT broker."""
@@ -270,7 +353,17 @@ class MQTTWorkOrderPublisher:
 
     def _on_publish(self, client: mqtt.Client, userdata: Any, mid: int, reason_code: int = 0, properties: Any = None) -> None:
         """Callback when message is published."""
-        print(f"Message published successfully. Message ID: {mid}")
+        with self._inflight_lock:
+            entry = self.inflight.pop(mid, None)
+            if entry is None:
+                # Beat _publish to the lock; it will report this message instead
+                self._early_acks.add(mid)
+                return
+        print(f"{entry[1]} published successfully. Message ID: {mid}")
+
+    def _on_socket_open(self, client: mqtt.Client, userdata: Any, sock: socket.socket) -> None:
+        """Callback when the broker socket is opened; disables Nagle so small publishes go out immediately."""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
     def connect(self) -> bool:
         """Connect to the MQTT broker."""
@@ -286,6 +379,12 @@ class MQTTWorkOrderPublisher:
             self.client.on_connect = self._on_connect
             self.client.on_disconnect = self._on_disconnect
             self.client.on_publish = self._on_publish
+            self.client.on_socket_open = self._on_socket_open
+
+            # Widen the in-flight window (paho default: 20). paho only applies it to
+            # QoS > 0, so it has no effect at the QoS 0 used by _publish; it is kept
+            # so raising QoS again isn't capped at roughly inflight / round-trip time
+            self.client.max_inflight_messages_set(1000)
 
             # Set credentials if provided
             endpoint = self.config['mqtt-endpoint']
@@ -321,51 +420,99 @@ class MQTTWorkOrderPublisher:
             self.client.disconnect()
             self.connected = False
 
-    def publish_work_order(self, work_order: dict[str, Any]) -> bool:
-        """
-        Publish a work order to the configured MQTT topic as a retained message.
-
-        Args:
-            work_order: The work order dictionary to publish
-
-        Returns:
-            True if published successfully, False otherwise
-        """
+    def _prune_inflight(self) -> None:
+        """Drop in-flight entries that have not been sent for too long. Caller holds the lock."""
+        cutoff = time.monotonic() - INFLIGHT_TIMEOUT_SECONDS
+        while self.inflight:
+            mid, (sent_at, description) = next(iter(self.inflight.items()))
+            if sent_at >= cutoff:
+                break
+            del self.inflight[mid]
+            print(f"{description} not yet sent after {INFLIGHT_TIMEOUT_SECONDS} seconds. Message ID: {mid}")
+
+    def _publish(self, payload: bytes, description: str) -> bool:
+        """Publish a payload to the configured MQTT topic as a retained message."""
         if not self.client or not self.connected:
             print("Not connected to MQTT broker")
             return False
 
         try:
             topic = self.config['mqtt-publish-topic']
-            payload = json.dumps(work_order, indent=2)
 
-            # Publish as retained message
+            # Publish as retained message at QoS 0; the next work order supersedes
+            # this one, so a lost message isn't worth a PUBACK round trip
             result = self.client.publish(
                 topic=topic,
                 payload=payload,
-                qos=1,
+                qos=0,
                 retain=True
             )
 
-            # Wait for publish to complete
-            result.wait_for_publish(timeout=10)
+            # Don't wait for the socket write; _on_publish reports once the message is sent
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                print(f"Failed to publish {description}: {mqtt.error_string(result.rc)}")
+                return False
 
-            if result.is_published():
-                print(f"Work order {work_order['WorkOrderNumber']} published to topic: {topic}")
-                return True
+            # Record the message without holding the lock across publish(); paho
+            # may call _on_publish from the network thread before this runs
+            with self._inflight_lock:
+                already_published = result.mid in self._early_acks
+                if already_published:
+                    self._early_acks.discard(result.mid)
+                else:
+                    self.inflight[result.mid] = (time.monotonic(), description)
+                    self.inflight.move_to_end(result.mid)
+                self._prune_inflight()
+
+            if already_published:
+                print(f"{description} published successfully. Message ID: {result.mid}")
             else:
-                print(f"Failed to publish work order {work_order['WorkOrderNumber']}")
-                return False
+                print(f"{description} queued for topic: {topic}")
+            return True
 
         except Exception as e:
-            print(f"Error publishing work order: {e}")
+            print(f"Error publishing {description}: {e}")
             return False
 
+    def publish_work_order(self, work_order: dict[str, Any]) -> bool:
+        """
+        Publish a work order to the configured MQTT topic as a retained message.
+
+        Args:
+            work_order: The work order dictionary to publish
+
+        Returns:
+            True if the message was handed to the client for delivery, False otherwise
+        """
+        return self._publish(_serialize_work_order(work_order), f"Work order {work_order['WorkOrderNumber']}")
+
+    def publish_work_orders(self, work_orders: list[dict[str, Any]]) -> bool:
+        """
+        Publish a batch of work orders as one retained {"WorkOrders": [...]} message.
+
+        A batch of one is published as a plain work order payload.
+
+        Args:
+            work_orders: The work order dictionaries to publish
+
+        Returns:
+            True if the message was handed to the client for delivery, False otherwise
+        """
+        if len(work_orders) == 1:
+            return self.publish_work_order(work_orders[0])
+
+        first, last = work_orders[0]['WorkOrderNumber'], work_orders[-1]['WorkOrderNumber']
+        return self._publish(_serialize_work_orders(work_orders), f"Work orders {first}-{last}")
+
 
 # =============================================================================
 # Main Application
 # =============================================================================
 
+PUBLISH_INTERVAL_SECONDS = 10
+WORK_QUEUE_SIZE = 1000  # Work orders buffered between the scheduler and the publisher thread
+
+
 def load_config(config_path: str = "config.json") -> dict[str, Any]:
     """Load configuration from JSON file."""
     try:
@@ -379,6 +526,28 @@ def load_config(config_path: str = "config.json") -> dict[str, Any]:
         raise
 
 
+def publish_worker(publisher: MQTTWorkOrderPublisher, work_queue: queue.Queue, batch_size: int) -> None:
+    """
+    Drain generated work orders from the queue and publish them in batches.
+
+    Runs on its own thread so MQTT latency never delays work order generation.
+    A None sentinel stops the worker after flushing any partial batch.
+    """
+    batch: list[dict[str, Any]] = []
+    while True:
+        work_order = work_queue.get()
+        if work_order is None:
+            break
+
+        batch.append(work_order)
+        if len(batch) >= batch_size:
+            publisher.publish_work_orders(batch)
+            batch = []
+
+    if batch:
+        publisher.publish_work_orders(batch)
+
+
 def main() -> None:
     """Main entry point for the work order publisher application."""
     print("=" * 60)
@@ -386,7 +555,7 @@ def main() -> None:
     print("=" * 60)
     print()
     print("This application demonstrates CESMII Smart Manufacturing Profiles")
-    print("by publishing work orders to an MQTT broker every 10 seconds.")
+    print(f"by publishing work orders to an MQTT broker every {PUBLISH_INTERVAL_SECONDS} seconds.")
     print()
     print(f"Work Order Namespace: {WORKORDER_NAMESPACE}")
     print(f"Feed Ingredient Namespace: {FEEDINGREDIENT_NAMESPACE}")
@@ -397,6 +566,8 @@ def main() -> None:
     config = load_config()
     print(f"MQTT Broker: {config['mqtt-endpoint']['host']}:{config['mqtt-endpoint']['port']}")
     print(f"Publish Topic: {config['mqtt-publish-topic']}")
+    batch_size = max(1, int(config.get('batch-size', 1)))
+    print(f"Batch Size: {batch_size}")
     print()
 
     # Create demo products
@@ -419,12 +590,23 @@ def main() -> None:
         return
     print()
 
+    # Hand work orders to a dedicated publisher thread
+    work_queue: queue.Queue = queue.Queue(maxsize=WORK_QUEUE_SIZE)
+    worker = threading.Thread(
+        target=publish_worker,
+        args=(publisher, work_queue, batch_size),
+        name="workorder-publisher",
+        daemon=True
+    )
+    worker.start()
+
     try:
-        # Main loop - publish work order every 10 seconds
-        print("Starting work order publishing loop (every 10 seconds)...")
+        # Main loop - publish work order every PUBLISH_INTERVAL_SECONDS
+        print(f"Starting work order publishing loop (every {PUBLISH_INTERVAL_SECONDS} seconds)...")
         print("Press Ctrl+C to stop.")
         print()
 
+        next_run = time.monotonic()
         while True:
             # Generate work order
             work_order = generator.generate_work_order()
@@ -439,18 +621,30 @@ def main() -> None:
             print(f"  Start (Local): {work_order['StartTimeLocal']}")
             print(f"  End (Local): {work_order['EndTimeLocal']}")
 
-            # Publish work order
-            publisher.publish_work_order(work_order)
+            # Queue for the publisher thread
+            try:
+                work_queue.put_nowait(work_order)
+            except queue.Full:
+                print(f"Publish queue full, dropping work order {work_order['WorkOrderNumber']}")
             print()
 
-            # Wait for 10 seconds before next work order
-            print("Waiting 10 seconds until next work order...")
-            time.sleep(10)
+            # Schedule against a fixed timeline so generation and publish time
+            # don't accumulate as drift; missed ticks are skipped, not burst
+            next_run += PUBLISH_INTERVAL_SECONDS
+            now = time.monotonic()
+            if next_run <= now:
+                next_run += ((now - next_run) // PUBLISH_INTERVAL_SECONDS + 1) * PUBLISH_INTERVAL_SECONDS
+            print(f"Waiting {next_run - now:.1f} seconds until next work order...")
+            time.sleep(next_run - now)
 
     except KeyboardInterrupt:
         print()
         print("Shutting down...")
     finally:
+        # Let the publisher thread flush anything still queued
+        if worker.is_alive():
+            work_queue.put(None)
+        worker.join(timeout=10)
         publisher.disconnect()
         print("Disconnected from MQTT broker.")
         print("Goodbye!")